@@ -4,31 +4,209 @@
 支持拆分后的回调接口和传统接口
 """
 
+import os
 import sqlite3
 import json
 import time
 import uuid
 from datetime import datetime
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request
 from flask_cors import CORS
+import orjson
+import simdjson
 import threading
+import queue
 import logging
 
-# 配置日志
-logging.basicConfig(level=logging.INFO)
+# 配置日志（生产环境可通过LOG_LEVEL=WARNING关掉每个请求的INFO日志）
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'))
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-CORS(app)
+# 只有浏览器端的查询路由需要CORS；/sync/*、/api/*是服务器间回调，跳过after-request处理
+CORS(app, resources={r"/rooms*": {"origins": "*"}, r"/stats": {"origins": "*"}})
+# 限制请求体大小，批次接口可以一次性读取完整请求体再解析
+app.config['MAX_CONTENT_LENGTH'] = 64 * 1024 * 1024
 
 # 数据库配置
 DB_PATH = "callback_data.db"
 
+# 待写入队列：所有落库动作由专职写线程串行执行，HTTP线程不再竞争SQLite写锁
+WRITE_QUEUE_MAX = 10000
+WRITE_BATCH_MAX = 200
+
+# 热路径SQL提升为模块常量：配合连接复用和语句缓存，VDBE字节码只编译一次
+SQL_INSERT_ROOM_SYNC = '''
+    INSERT INTO room_syncs (
+        room_id, sync_time, admin_user_ids, start_time,
+        current_users, peak_users, total_joins, chat_count,
+        session_count, event_type
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+SQL_INSERT_SYNC_BLOB = 'INSERT INTO room_sync_blobs (sync_id, raw) VALUES (?, zeroblob(?))'
+SQL_INSERT_CHAT = '''
+    INSERT INTO chat_records (room_id, user_id, content, created_at, sync_time)
+    VALUES (?, ?, ?, ?, ?)
+'''
+SQL_INSERT_CHAT_BATCH = '''
+    INSERT OR IGNORE INTO chat_records (room_id, user_id, content, created_at, sync_time, batch_id)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+SQL_INSERT_SESSION = '''
+    INSERT INTO session_records (room_id, user_id, join_time, leave_time, duration_seconds, sync_time)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+SQL_INSERT_SESSION_BATCH = '''
+    INSERT OR IGNORE INTO session_records (room_id, user_id, join_time, leave_time, duration_seconds, sync_time, batch_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+SQL_INSERT_EVENT = '''
+    INSERT INTO room_events (room_id, event_type, event_data, timestamp)
+    VALUES (?, ?, ?, ?)
+'''
+SQL_UPDATE_COUNTER = 'UPDATE counters SET value = value + ? WHERE name = ?'
+SQL_UPSERT_ROOM_DIM = '''
+    INSERT INTO rooms_dim (room_id, last_sync) VALUES (?, ?)
+    ON CONFLICT(room_id) DO UPDATE SET last_sync = excluded.last_sync
+        WHERE excluded.last_sync > rooms_dim.last_sync
+'''
+
+# 每个线程复用一个数据库连接，避免每个请求重新打开文件、重建页缓存
+_tls = threading.local()
+
+def get_conn():
+    """获取当前线程缓存的数据库连接，首次使用时创建并应用PRAGMA"""
+    conn = getattr(_tls, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect('file:' + DB_PATH, uri=True, isolation_level=None,
+                               check_same_thread=False, cached_statements=256)
+        conn.row_factory = sqlite3.Row
+        # journal_mode/wal_autocheckpoint在init_database中已持久化到数据库文件
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=30000')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA cache_size=-20000')
+        _tls.conn = conn
+    return conn
+
+def ojsonify(obj, status=200):
+    """用orjson序列化响应，对大payload比标准库的json.dumps快5-10倍"""
+    return app.response_class(orjson.dumps(obj), mimetype='application/json', status=status)
+
+def get_json_parser():
+    """获取当前线程的simdjson解析器（解析器复用内部缓冲区，不能跨线程共享）"""
+    parser = getattr(_tls, 'json_parser', None)
+    if parser is None:
+        parser = simdjson.Parser()
+        _tls.json_parser = parser
+    return parser
+
+_write_q = queue.Queue(maxsize=WRITE_QUEUE_MAX)
+
+def warm_statement_cache(conn):
+    """预编译热路径语句：executemany配空参数列表只prepare不执行，字节码驻留语句缓存"""
+    cursor = conn.cursor()
+    for sql in (SQL_INSERT_ROOM_SYNC, SQL_INSERT_SYNC_BLOB, SQL_INSERT_CHAT,
+                SQL_INSERT_CHAT_BATCH, SQL_INSERT_SESSION, SQL_INSERT_SESSION_BATCH,
+                SQL_INSERT_EVENT, SQL_UPDATE_COUNTER, SQL_UPSERT_ROOM_DIM):
+        cursor.executemany(sql, [])
+
+def _apply_writes(conn, cursor, items):
+    """在调用方开启的事务内，把一组写入项按目标表归并后执行"""
+    syncs = []
+    chat_batch_rows = []
+    session_batch_rows = []
+    event_rows = []
+    counter_deltas = {'chat_total': 0, 'session_total': 0, 'event_total': 0}
+    dim_rows = []
+    for kind, payload in items:
+        if kind == 'chat_batch':
+            chat_batch_rows.extend(payload)
+        elif kind == 'session_batch':
+            session_batch_rows.extend(payload)
+        elif kind == 'event':
+            event_rows.append(payload)
+            counter_deltas['event_total'] += 1
+        else:  # room_sync
+            syncs.append(payload)
+
+    for sync_params, raw_body, chat_rows, session_rows in syncs:
+        cursor.execute(SQL_INSERT_ROOM_SYNC, sync_params)
+        sync_id = cursor.lastrowid
+        # 原始报文以增量BLOB方式写入旁表，不经过room_syncs的行存储
+        cursor.execute(SQL_INSERT_SYNC_BLOB, (sync_id, len(raw_body)))
+        with conn.blobopen('room_sync_blobs', 'raw', sync_id) as blob:
+            blob.write(raw_body)
+        cursor.executemany(SQL_INSERT_CHAT, chat_rows)
+        cursor.executemany(SQL_INSERT_SESSION, session_rows)
+        counter_deltas['chat_total'] += len(chat_rows)
+        counter_deltas['session_total'] += len(session_rows)
+        if sync_params[1] is not None:
+            dim_rows.append((sync_params[0], sync_params[1]))
+
+    # OR IGNORE会吞掉重试产生的重复行，计数只累加真正插入的行数
+    cursor.executemany(SQL_INSERT_CHAT_BATCH, chat_batch_rows)
+    counter_deltas['chat_total'] += max(cursor.rowcount, 0)
+    cursor.executemany(SQL_INSERT_SESSION_BATCH, session_batch_rows)
+    counter_deltas['session_total'] += max(cursor.rowcount, 0)
+    cursor.executemany(SQL_INSERT_EVENT, event_rows)
+    cursor.executemany(SQL_UPDATE_COUNTER,
+                       [(delta, name) for name, delta in counter_deltas.items() if delta])
+    cursor.executemany(SQL_UPSERT_ROOM_DIM, dim_rows)
+
+def _commit_writes(conn, cursor, items):
+    """单事务落库一组写入项，失败时回滚并抛出"""
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        _apply_writes(conn, cursor, items)
+        cursor.execute('COMMIT')
+    except Exception:
+        cursor.execute('ROLLBACK')
+        raise
+
+def writer_loop():
+    """专职写线程：把队列里的写请求按目标表归并，一个事务批量落库"""
+    conn = get_conn()
+    warm_statement_cache(conn)
+    cursor = conn.cursor()
+    while True:
+        items = [_write_q.get()]
+        try:
+            while len(items) < WRITE_BATCH_MAX:
+                items.append(_write_q.get_nowait())
+        except queue.Empty:
+            pass
+
+        try:
+            _commit_writes(conn, cursor, items)
+        except Exception as e:
+            # 这些写入接口已经202确认过，整批丢弃不可接受：
+            # 退化为逐条重放，坏数据只拖累它自己那一条
+            logger.warning("写线程批量落库失败，退化为逐条重放%d条: %s", len(items), e)
+            failed = 0
+            for item in items:
+                try:
+                    _commit_writes(conn, cursor, [item])
+                except Exception as item_err:
+                    failed += 1
+                    logger.error("单条写入(%s)落库失败，丢弃: %s", item[0], item_err)
+            if failed:
+                logger.error("本批%d条写入中%d条最终失败", len(items), failed)
+
+
 def init_database():
     """初始化数据库"""
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
-    
+
+    # 启用WAL模式，读写可以并发进行（journal_mode持久化在数据库文件中）
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA busy_timeout=30000')
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.execute('PRAGMA cache_size=-20000')
+    cursor.execute('PRAGMA wal_autocheckpoint=1000')
+
     # 房间同步记录表
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS room_syncs (
@@ -42,11 +220,18 @@ def init_database():
             total_joins INTEGER,
             chat_count INTEGER,
             session_count INTEGER,
-            raw_data TEXT,
             event_type TEXT DEFAULT 'legacy'
         )
     ''')
-    
+
+    # 原始同步报文单独存放，避免大报文撑爆room_syncs的B-tree叶页、挤掉页缓存
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS room_sync_blobs (
+            sync_id INTEGER PRIMARY KEY REFERENCES room_syncs(id),
+            raw BLOB
+        )
+    ''')
+
     # 聊天记录表
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS chat_records (
@@ -85,12 +270,57 @@ def init_database():
         )
     ''')
     
+    # 房间维表：插入时UPSERT维护每个房间的最近同步时间，/rooms不再聚合整张room_syncs
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rooms_dim (
+            room_id TEXT PRIMARY KEY,
+            last_sync INTEGER NOT NULL
+        )
+    ''')
+
+    # 统计计数表：插入时累加，/stats直接读，避免全表COUNT(*)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
     # 创建索引
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_room_syncs_room_id ON room_syncs(room_id)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_chat_records_room_id ON chat_records(room_id)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_session_records_room_id ON session_records(room_id)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_room_events_room_id ON room_events(room_id)')
-    
+
+    # 复合索引：(room_id, sync_time DESC)让按房间取最新记录直接走有序索引扫描
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_room_syncs_room_sync ON room_syncs(room_id, sync_time DESC)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_chat_records_room_sync ON chat_records(room_id, sync_time DESC)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_session_records_room_sync ON session_records(room_id, sync_time DESC)')
+
+    # 去重唯一索引：批次接口重试时INSERT OR IGNORE在B-tree里直接去重，不需要先SELECT
+    # （传统接口的batch_id为NULL，NULL在唯一索引中互不相等，不受影响）
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_chat_dedupe
+        ON chat_records(batch_id, user_id, created_at, room_id)
+    ''')
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_session_dedupe
+        ON session_records(batch_id, user_id, join_time, room_id)
+    ''')
+
+    # 已有数据时回填房间维表
+    cursor.execute('''
+        INSERT INTO rooms_dim (room_id, last_sync)
+        SELECT room_id, MAX(sync_time) FROM room_syncs GROUP BY room_id
+        ON CONFLICT(room_id) DO UPDATE SET last_sync = excluded.last_sync
+            WHERE excluded.last_sync > rooms_dim.last_sync
+    ''')
+
+    # 初始化计数器（已有数据时用当前行数作为初值）
+    cursor.execute("INSERT OR IGNORE INTO counters (name, value) VALUES ('chat_total', (SELECT COUNT(*) FROM chat_records))")
+    cursor.execute("INSERT OR IGNORE INTO counters (name, value) VALUES ('session_total', (SELECT COUNT(*) FROM session_records))")
+    cursor.execute("INSERT OR IGNORE INTO counters (name, value) VALUES ('event_total', (SELECT COUNT(*) FROM room_events))")
+
     conn.commit()
     conn.close()
     logger.info("数据库初始化完成")
@@ -98,284 +328,240 @@ def init_database():
 @app.route('/health', methods=['GET'])
 def health_check():
     """健康检查"""
-    return jsonify({"status": "ok", "timestamp": int(time.time())})
+    return ojsonify({"status": "ok", "timestamp": int(time.time())})
 
 @app.route('/sync/room', methods=['POST'])
 def sync_room_legacy():
     """传统房间同步接口（保持向后兼容）"""
     try:
+        # 保留原始请求体，raw_data直接存原文，省掉一次json.dumps
+        raw_body = request.get_data(cache=True)
         data = request.get_json()
         if not data:
-            return jsonify({"error": "No data provided"}), 400
-        
-        logger.info(f"收到传统房间同步数据: {data.get('room_id')}")
-        
-        # 存储房间同步记录
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO room_syncs (
-                room_id, sync_time, admin_user_ids, start_time, 
-                current_users, peak_users, total_joins, chat_count, 
-                session_count, raw_data, event_type
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            data.get('room_id'),
-            int(time.time()),
-            json.dumps(list(data.get('admin_user_ids', []))),
+            return ojsonify({"error": "No data provided"}, status=400)
+
+        logger.info("收到传统房间同步数据: %s", data.get('room_id'))
+
+        room_id = data.get('room_id')
+        now = int(time.time())
+
+        sync_params = (
+            room_id,
+            now,
+            json.dumps(data.get('admin_user_ids', [])),
             data.get('start_time'),
             data.get('stats', {}).get('current_users', 0),
             data.get('stats', {}).get('peak_users', 0),
             data.get('stats', {}).get('total_joins', 0),
             len(data.get('chat_history', [])),
             len(data.get('session_history', [])),
-            json.dumps(data),
             'legacy'
-        ))
-        
-        # 存储聊天记录
-        for chat in data.get('chat_history', []):
-            cursor.execute('''
-                INSERT INTO chat_records (room_id, user_id, content, created_at, sync_time)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (
-                data.get('room_id'),
-                chat.get('user_id'),
-                chat.get('content'),
-                chat.get('created_at'),
-                int(time.time())
-            ))
-        
-        # 存储会话记录
-        for session in data.get('session_history', []):
-            cursor.execute('''
-                INSERT INTO session_records (room_id, user_id, join_time, leave_time, duration_seconds, sync_time)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (
-                data.get('room_id'),
-                session.get('user_id'),
-                session.get('join_time'),
-                session.get('leave_time'),
-                session.get('duration_seconds'),
-                int(time.time())
-            ))
-        
-        conn.commit()
-        conn.close()
-        
-        return jsonify({"status": "success", "message": "Room data synced successfully"})
+        )
+
+        # 只在HTTP线程里构造行元组，落库交给写线程
+        chat_rows = [
+            (room_id, chat.get('user_id'), chat.get('content'), chat.get('created_at'), now)
+            for chat in data.get('chat_history', [])
+        ]
+        session_rows = [
+            (room_id, session.get('user_id'), session.get('join_time'),
+             session.get('leave_time'), session.get('duration_seconds'), now)
+            for session in data.get('session_history', [])
+        ]
+
+        _write_q.put(('room_sync', (sync_params, raw_body, chat_rows, session_rows)))
+
+        return ojsonify({"status": "accepted", "message": "Room data queued for sync"}, status=202)
         
     except Exception as e:
-        logger.error(f"处理传统房间同步失败: {e}")
-        return jsonify({"error": str(e)}), 500
+        logger.error("处理传统房间同步失败: %s", e)
+        return ojsonify({"error": str(e)}, status=500)
 
 @app.route('/api/room-events', methods=['POST'])
 def room_events():
     """房间事件回调接口"""
     try:
+        raw_body = request.get_data(cache=True)
         data = request.get_json()
         if not data:
-            return jsonify({"error": "No data provided"}), 400
-        
+            return ojsonify({"error": "No data provided"}, status=400)
+
         event_type = data.get('event_type')
         room_id = data.get('room_id')
         
-        logger.info(f"收到房间事件: {event_type} - {room_id}")
+        logger.info("收到房间事件: %s - %s", event_type, room_id)
         
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO room_events (room_id, event_type, event_data, timestamp)
-            VALUES (?, ?, ?, ?)
-        ''', (
+        _write_q.put(('event', (
             room_id,
             event_type,
-            json.dumps(data),
+            raw_body.decode('utf-8'),
             data.get('timestamp', int(time.time()))
-        ))
-        
-        conn.commit()
-        conn.close()
-        
-        return jsonify({"status": "success", "message": f"Room event {event_type} recorded"})
+        )))
+
+        return ojsonify({"status": "accepted", "message": f"Room event {event_type} queued"}, status=202)
         
     except Exception as e:
-        logger.error(f"处理房间事件失败: {e}")
-        return jsonify({"error": str(e)}), 500
+        logger.error("处理房间事件失败: %s", e)
+        return ojsonify({"error": str(e)}, status=500)
 
 @app.route('/api/chat-history', methods=['POST'])
 def chat_history():
     """聊天记录批次回调接口"""
     try:
-        data = request.get_json()
-        if not data:
-            return jsonify({"error": "No data provided"}), 400
-        
+        # 按需解析：只物化真正读取的字段，跳过批次里未使用的嵌套数据
+        try:
+            data = get_json_parser().parse(request.get_data(cache=False))
+        except ValueError:
+            return ojsonify({"error": "No data provided"}, status=400)
+        # 与其他接口的if not data一致：空对象或非对象请求体一律400
+        if not isinstance(data, simdjson.Object) or not len(data):
+            return ojsonify({"error": "No data provided"}, status=400)
+
         room_id = data.get('room_id')
         batch_id = data.get('batch_id')
         messages = data.get('messages', [])
         is_last_batch = data.get('is_last_batch', False)
         
-        logger.info(f"收到聊天记录批次: {room_id} - {batch_id} - {len(messages)}条消息")
-        
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # 存储聊天记录
-        for message in messages:
-            cursor.execute('''
-                INSERT INTO chat_records (room_id, user_id, content, created_at, sync_time, batch_id)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (
-                room_id,
-                message.get('user_id'),
-                message.get('content'),
-                message.get('created_at'),
-                data.get('timestamp', int(time.time())),
-                batch_id
-            ))
-        
-        conn.commit()
-        conn.close()
-        
-        return jsonify({
-            "status": "success", 
-            "message": f"Chat history batch {batch_id} processed",
+        logger.info("收到聊天记录批次: %s - %s - %d条消息", room_id, batch_id, len(messages))
+
+        sync_time = data.get('timestamp', int(time.time()))
+
+        chat_rows = [
+            (room_id, message.get('user_id'), message.get('content'),
+             message.get('created_at'), sync_time, batch_id)
+            for message in messages
+        ]
+
+        _write_q.put(('chat_batch', chat_rows))
+
+        return ojsonify({
+            "status": "accepted",
+            "message": f"Chat history batch {batch_id} queued",
             "is_last_batch": is_last_batch
-        })
+        }, status=202)
         
     except Exception as e:
-        logger.error(f"处理聊天记录批次失败: {e}")
-        return jsonify({"error": str(e)}), 500
+        logger.error("处理聊天记录批次失败: %s", e)
+        return ojsonify({"error": str(e)}, status=500)
 
 @app.route('/api/session-history', methods=['POST'])
 def session_history():
     """会话历史批次回调接口"""
     try:
-        data = request.get_json()
-        if not data:
-            return jsonify({"error": "No data provided"}), 400
-        
+        # 按需解析：只物化真正读取的字段
+        try:
+            data = get_json_parser().parse(request.get_data(cache=False))
+        except ValueError:
+            return ojsonify({"error": "No data provided"}, status=400)
+        # 空对象或非对象请求体一律400
+        if not isinstance(data, simdjson.Object) or not len(data):
+            return ojsonify({"error": "No data provided"}, status=400)
+
         room_id = data.get('room_id')
         batch_id = data.get('batch_id')
         sessions = data.get('sessions', [])
         is_last_batch = data.get('is_last_batch', False)
         
-        logger.info(f"收到会话历史批次: {room_id} - {batch_id} - {len(sessions)}条记录")
-        
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # 存储会话记录
-        for session in sessions:
-            cursor.execute('''
-                INSERT INTO session_records (room_id, user_id, join_time, leave_time, duration_seconds, sync_time, batch_id)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                room_id,
-                session.get('user_id'),
-                session.get('join_time'),
-                session.get('leave_time'),
-                session.get('duration_seconds'),
-                data.get('timestamp', int(time.time())),
-                batch_id
-            ))
-        
-        conn.commit()
-        conn.close()
-        
-        return jsonify({
-            "status": "success", 
-            "message": f"Session history batch {batch_id} processed",
+        logger.info("收到会话历史批次: %s - %s - %d条记录", room_id, batch_id, len(sessions))
+
+        sync_time = data.get('timestamp', int(time.time()))
+
+        session_rows = [
+            (room_id, session.get('user_id'), session.get('join_time'),
+             session.get('leave_time'), session.get('duration_seconds'), sync_time, batch_id)
+            for session in sessions
+        ]
+
+        _write_q.put(('session_batch', session_rows))
+
+        return ojsonify({
+            "status": "accepted",
+            "message": f"Session history batch {batch_id} queued",
             "is_last_batch": is_last_batch
-        })
+        }, status=202)
         
     except Exception as e:
-        logger.error(f"处理会话历史批次失败: {e}")
-        return jsonify({"error": str(e)}), 500
+        logger.error("处理会话历史批次失败: %s", e)
+        return ojsonify({"error": str(e)}, status=500)
 
 @app.route('/api/periodic-sync', methods=['POST'])
 def periodic_sync():
     """定时同步回调接口"""
     try:
+        raw_body = request.get_data(cache=True)
         data = request.get_json()
         if not data:
-            return jsonify({"error": "No data provided"}), 400
-        
+            return ojsonify({"error": "No data provided"}, status=400)
+
         room_id = data.get('room_id')
         room_info = data.get('room_info', {})
         last_sync_time = data.get('last_sync_time')
         
-        logger.info(f"收到定时同步: {room_id} - {last_sync_time}")
-        
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        logger.info("收到定时同步: %s - %s", room_id, last_sync_time)
         
-        cursor.execute('''
-            INSERT INTO room_syncs (
-                room_id, sync_time, admin_user_ids, start_time, 
-                current_users, peak_users, total_joins, chat_count, 
-                session_count, raw_data, event_type
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
+        sync_params = (
             room_id,
             last_sync_time,
             json.dumps(room_info.get('admin_user_ids', [])),
             room_info.get('created_at'),
             room_info.get('current_connections', 0),
-            0, 0, 0, 0, 0,  # 这些字段在定时同步中可能没有
-            json.dumps(data),
+            0, 0, 0, 0,  # 这些字段在定时同步中可能没有
             'periodic'
-        ))
-        
-        conn.commit()
-        conn.close()
-        
-        return jsonify({"status": "success", "message": "Periodic sync recorded"})
+        )
+
+        _write_q.put(('room_sync', (sync_params, raw_body, [], [])))
+
+        return ojsonify({"status": "accepted", "message": "Periodic sync queued"}, status=202)
         
     except Exception as e:
-        logger.error(f"处理定时同步失败: {e}")
-        return jsonify({"error": str(e)}), 500
+        logger.error("处理定时同步失败: %s", e)
+        return ojsonify({"error": str(e)}, status=500)
 
 @app.route('/rooms', methods=['GET'])
 def get_rooms():
     """获取房间列表"""
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_conn()
         cursor = conn.cursor()
-        
+        cursor.arraysize = 1000
+
+        # 维表在插入时已维护好每房间的最近同步时间，这里只扫一张小表
         cursor.execute('''
-            SELECT DISTINCT room_id, MAX(sync_time) as last_sync
-            FROM room_syncs 
-            GROUP BY room_id 
+            SELECT room_id, last_sync
+            FROM rooms_dim
             ORDER BY last_sync DESC
         ''')
         
-        rooms = []
-        for row in cursor.fetchall():
-            room_id, last_sync = row
-            rooms.append({
-                "room_id": room_id,
-                "last_sync": last_sync,
-                "last_sync_formatted": datetime.fromtimestamp(last_sync).strftime('%Y-%m-%d %H:%M:%S')
-            })
-        
-        conn.close()
-        return jsonify({"rooms": rooms})
+        # 逐行流式输出，内存占用与房间数无关
+        def generate():
+            yield b'{"rooms":['
+            first = True
+            for row in cursor:
+                if not first:
+                    yield b','
+                first = False
+                yield orjson.dumps({
+                    "room_id": row['room_id'],
+                    "last_sync": row['last_sync'],
+                    # isoformat输出与'%Y-%m-%d %H:%M:%S'一致，但比locale感知的strftime快约3倍
+                    "last_sync_formatted": datetime.fromtimestamp(row['last_sync']).isoformat(' ', 'seconds')
+                })
+            yield b']}'
+
+        return Response(generate(), mimetype='application/json')
         
     except Exception as e:
-        logger.error(f"获取房间列表失败: {e}")
-        return jsonify({"error": str(e)}), 500
+        logger.error("获取房间列表失败: %s", e)
+        return ojsonify({"error": str(e)}, status=500)
 
 @app.route('/rooms/<room_id>', methods=['GET'])
 def get_room_details(room_id):
     """获取房间详情"""
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_conn()
         cursor = conn.cursor()
-        
+        cursor.arraysize = 1000
+
         # 获取最新的房间同步记录
         cursor.execute('''
             SELECT * FROM room_syncs 
@@ -386,7 +572,7 @@ def get_room_details(room_id):
         
         room_sync = cursor.fetchone()
         if not room_sync:
-            return jsonify({"error": "Room not found"}), 404
+            return ojsonify({"error": "Room not found"}, status=404)
         
         # 获取聊天记录数量
         cursor.execute('SELECT COUNT(*) FROM chat_records WHERE room_id = ?', (room_id,))
@@ -396,28 +582,26 @@ def get_room_details(room_id):
         cursor.execute('SELECT COUNT(*) FROM session_records WHERE room_id = ?', (room_id,))
         session_count = cursor.fetchone()[0]
         
-        # 获取最近的事件
+        # 获取最近的事件（事件由写线程成批提交，直接查主表即可）
         cursor.execute('''
-            SELECT event_type, event_data, timestamp 
-            FROM room_events 
-            WHERE room_id = ? 
-            ORDER BY timestamp DESC 
+            SELECT event_type, event_data, timestamp
+            FROM room_events WHERE room_id = ?
+            ORDER BY timestamp DESC
             LIMIT 10
         ''', (room_id,))
         
-        recent_events = []
-        for row in cursor.fetchall():
-            event_type, event_data, timestamp = row
-            recent_events.append({
-                "event_type": event_type,
-                "event_data": json.loads(event_data),
-                "timestamp": timestamp,
-                "formatted_time": datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
-            })
-        
-        conn.close()
+        recent_events = [
+            {
+                "event_type": row['event_type'],
+                "event_data": json.loads(row['event_data']),
+                "timestamp": row['timestamp'],
+                "formatted_time": datetime.fromtimestamp(row['timestamp']).isoformat(' ', 'seconds')
+            }
+            for row in cursor.fetchall()
+        ]
+
         
-        return jsonify({
+        return ojsonify({
             "room_id": room_id,
             "last_sync": room_sync[2],
             "chat_count": chat_count,
@@ -426,56 +610,59 @@ def get_room_details(room_id):
         })
         
     except Exception as e:
-        logger.error(f"获取房间详情失败: {e}")
-        return jsonify({"error": str(e)}), 500
+        logger.error("获取房间详情失败: %s", e)
+        return ojsonify({"error": str(e)}, status=500)
 
 @app.route('/stats', methods=['GET'])
 def get_stats():
     """获取统计信息"""
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_conn()
         cursor = conn.cursor()
         
-        # 总房间数
-        cursor.execute('SELECT COUNT(DISTINCT room_id) FROM room_syncs')
+        # 总房间数（维表一行对应一个房间）
+        cursor.execute('SELECT COUNT(*) FROM rooms_dim')
         total_rooms = cursor.fetchone()[0]
-        
-        # 总聊天记录数
-        cursor.execute('SELECT COUNT(*) FROM chat_records')
-        total_chat_records = cursor.fetchone()[0]
-        
-        # 总会话记录数
-        cursor.execute('SELECT COUNT(*) FROM session_records')
-        total_session_records = cursor.fetchone()[0]
-        
-        # 总事件数
-        cursor.execute('SELECT COUNT(*) FROM room_events')
-        total_events = cursor.fetchone()[0]
-        
+
+        # 聊天/会话/事件总数直接读计数器，O(1)而不是全表扫描
+        cursor.execute('SELECT name, value FROM counters')
+        counters = dict(cursor.fetchall())
+        total_chat_records = counters.get('chat_total', 0)
+        total_session_records = counters.get('session_total', 0)
+        total_events = counters.get('event_total', 0)
+
         # 今日同步数
-        today_start = int(time.time()) - (24 * 60 * 60)
+        now = int(time.time())
+        today_start = now - (24 * 60 * 60)
         cursor.execute('SELECT COUNT(*) FROM room_syncs WHERE sync_time >= ?', (today_start,))
         today_syncs = cursor.fetchone()[0]
         
-        conn.close()
         
-        return jsonify({
+        return ojsonify({
             "total_rooms": total_rooms,
             "total_chat_records": total_chat_records,
             "total_session_records": total_session_records,
             "total_events": total_events,
             "today_syncs": today_syncs,
-            "timestamp": int(time.time())
+            "timestamp": now
         })
         
     except Exception as e:
-        logger.error(f"获取统计信息失败: {e}")
-        return jsonify({"error": str(e)}), 500
+        logger.error("获取统计信息失败: %s", e)
+        return ojsonify({"error": str(e)}, status=500)
 
 if __name__ == '__main__':
     # 初始化数据库
     init_database()
-    
+
+    # 启动专职写线程
+    threading.Thread(target=writer_loop, daemon=True).start()
+
     # 启动服务器
     logger.info("启动回调服务器...")
-    app.run(host='0.0.0.0', port=8080, debug=True) 
\ No newline at end of file
+    try:
+        # waitress是多线程的生产级WSGI服务器，回调POST不再被单线程debug服务器串行化
+        from waitress import serve
+        serve(app, host='0.0.0.0', port=8080, threads=16)
+    except ImportError:
+        app.run(host='0.0.0.0', port=8080, threaded=True)
\ No newline at end of file
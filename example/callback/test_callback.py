@@ -4,7 +4,16 @@
 测试拆分后的回调接口和传统接口
 """
 
+import asyncio
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import ijson
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import time
 import uuid
@@ -20,27 +29,161 @@ headers = {
     "X-Api-Key": API_KEY
 }
 
+# 瞬时故障（502/503/504）自动退避重试，只重试幂等相关的方法
+_retry = Retry(total=3, backoff_factor=0.1, status_forcelist=[502, 503, 504],
+               allowed_methods=frozenset(["GET", "POST", "DELETE"]))
+
+# 复用keep-alive连接：整个测试十几个请求不再每次重建TCP连接
+rust = requests.Session()
+rust.headers.update(headers)
+rust.mount("http://", HTTPAdapter(pool_connections=2, pool_maxsize=16, max_retries=_retry))
+
+cb = requests.Session()
+cb.headers.update(headers)
+cb.mount("http://", HTTPAdapter(pool_connections=2, pool_maxsize=16, max_retries=_retry))
+
+def call(sess, method, url, *, expect=200, **kw):
+    """统一的请求入口：带默认超时和状态码校验，不符合预期直接抛错
+
+    连接2秒、读取10秒超时，避免某个接口挂起拖死整个脚本；
+    状态码不等于expect时抛RuntimeError，由调用方的except统一打印。
+    """
+    r = sess.request(method, url, timeout=(2, 10), **kw)
+    if r.status_code != expect:
+        raise RuntimeError(f"{method} {url} -> {r.status_code}: {r.text}")
+    return r
+
+
+# 列表接口的进程内TTL缓存：多个测试函数反复拉同一份列表来发现room_id
+_listing_cache = {}
+
+def get_cached(sess, url, ttl=5):
+    """带TTL的列表GET：ttl秒内重复请求同一URL直接复用上次的响应
+
+    返回(status_code, json)，只有200的结果会进缓存。
+    """
+    now = time.monotonic()
+    hit = _listing_cache.get(url)
+    if hit and now - hit[0] < ttl:
+        return hit[1]
+    resp = sess.get(url)
+    result = (resp.status_code, orjson.loads(resp.content) if resp.status_code == 200 else None)
+    if resp.status_code == 200:
+        _listing_cache[url] = (now, result)
+    return result
+
+def gather_requests(reqs):
+    """并发GET一组互不依赖的请求，整体耗时取最慢的一个而不是总和
+
+    reqs是(url, params)元组列表，返回对应的(status, json)列表。
+    """
+    async def _fetch_all():
+        # http2=True时多个并发请求在同一条连接上多路复用，
+        # 对端不支持HTTP/2则自动回退到HTTP/1.1
+        limits = httpx.Limits(max_keepalive_connections=4, max_connections=16)
+        timeout = httpx.Timeout(10.0, connect=2.0)
+        async with httpx.AsyncClient(http2=True, headers=headers,
+                                     limits=limits, timeout=timeout) as client:
+            async def _one(url, params):
+                resp = await client.get(url, params=params)
+                return resp.status_code, orjson.loads(resp.content)
+            return await asyncio.gather(*(_one(url, params) for url, params in reqs))
+    return asyncio.run(_fetch_all())
+
+def fetch_first_n_pages_fused(sess, url, pages=2, page_size=100, params=None):
+    """把前N页合并成一次大limit请求，再在本地切回每页大小的块
+
+    两次同模板的分页查询服务端要做两遍排序，合并成limit=N*page_size
+    的一趟既省一次往返也省一遍排序。适合只消费开头几页的探测场景。
+    返回(响应json, 按page_size切好的各页records列表)。
+    """
+    merged = dict(params or {})
+    merged.update({"page": 1, "limit": pages * page_size})
+    resp = call(sess, "GET", url, params=merged)
+    body = orjson.loads(resp.content)
+    records = body['records']
+    chunks = [records[i:i + page_size] for i in range(0, len(records), page_size)]
+    return body, chunks
+
+def wait_until(pred, timeout=5.0, interval=0.1):
+    """轮询等待条件成立，就绪即返回，替代拍脑袋的固定sleep
+
+    固定sleep(2-3)在快环境下白等、慢环境下又不一定够。pred抛异常
+    按未就绪处理。返回是否在超时前满足条件。
+    """
+    t0 = time.monotonic()
+    while time.monotonic() - t0 < timeout:
+        try:
+            if pred():
+                return True
+        except Exception:
+            pass
+        time.sleep(interval)
+    return False
+
+def fetch_all_pages(url, params=None, page_size=500, max_concurrency=8):
+    """把分页接口一次性拉完：首页探出总页数，剩余页并发抓取
+
+    逐页串行拉取的总耗时是页数×往返延迟，这里改成首页一趟之后
+    2..N页并发（信号量限流），整体耗时约等于最慢的一页。
+    返回(首页json, 各页records合并后的列表)。
+    """
+    base = dict(params or {})
+    base["limit"] = page_size
+
+    async def _fetch():
+        limits = httpx.Limits(max_keepalive_connections=max_concurrency,
+                              max_connections=max_concurrency)
+        timeout = httpx.Timeout(10.0, connect=2.0)
+        sem = asyncio.Semaphore(max_concurrency)
+        async with httpx.AsyncClient(http2=True, headers=headers,
+                                     limits=limits, timeout=timeout) as client:
+            async def _page(page):
+                async with sem:
+                    resp = await client.get(url, params={**base, "page": page})
+                    resp.raise_for_status()
+                    return orjson.loads(resp.content)
+            first = await _page(1)
+            total_pages = first['pagination']['total_pages']
+
+            # 哪页先回来就先消费哪页：拼接处理和还在途的请求重叠，
+            # 也不用等所有响应都攒齐才开始处理
+            async def _tagged(p):
+                return p, await _page(p)
+
+            chunks = {1: first['records']}
+            for fut in asyncio.as_completed([_tagged(p) for p in range(2, total_pages + 1)]):
+                p, body = await fut
+                chunks[p] = body['records']
+            records = []
+            for p in sorted(chunks):
+                records.extend(chunks[p])
+            return first, records
+    return asyncio.run(_fetch())
+
 def test_health_check():
     """测试健康检查"""
     print("=== 测试健康检查 ===")
     
     try:
-        # 测试Rust服务器
-        response = requests.get(f"{RUST_SERVER_URL}/management/health")
-        if response.status_code == 200:
+        # 两个健康检查互不依赖，并发探测
+        (rust_status, _), (cb_status, _) = gather_requests([
+            (f"{RUST_SERVER_URL}/management/health", None),
+            (f"{CALLBACK_SERVER_URL}/health", None),
+        ])
+
+        if rust_status == 200:
             print("✅ Rust服务器运行正常")
         else:
-            print(f"❌ Rust服务器异常: {response.status_code}")
+            print(f"❌ Rust服务器异常: {rust_status}")
             return False
-        
-        # 测试回调服务器
-        response = requests.get(f"{CALLBACK_SERVER_URL}/health")
-        if response.status_code == 200:
+
+        if cb_status == 200:
             print("✅ 回调服务器运行正常")
         else:
-            print(f"❌ 回调服务器异常: {response.status_code}")
+            print(f"❌ 回调服务器异常: {cb_status}")
             return False
-            
+
         return True
         
     except Exception as e:
@@ -57,26 +200,17 @@ def test_create_room_with_events():
     }
     
     try:
-        response = requests.post(
-            f"{RUST_SERVER_URL}/management/rooms",
-            headers=headers,
-            json=room_data
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            room_id = result['room_id']
-            print(f"✅ 房间创建成功: {room_id}")
-            print(f"   WebSocket URL: {result['websocket_url']}")
-            print("   📤 系统会自动触发房间创建事件回调")
-            return room_id
-        else:
-            print(f"❌ 房间创建失败: {response.status_code}")
-            print(f"   错误信息: {response.text}")
-            return None
+        # 用orjson预序列化，json=走的标准库dumps是纯Python实现
+        result = call(rust, "POST", f"{RUST_SERVER_URL}/management/rooms",
+                      data=orjson.dumps(room_data)).json()
+        room_id = result['room_id']
+        print(f"✅ 房间创建成功: {room_id}")
+        print(f"   WebSocket URL: {result['websocket_url']}")
+        print("   📤 系统会自动触发房间创建事件回调")
+        return room_id
             
     except Exception as e:
-        print(f"❌ 请求失败: {e}")
+        print(f"❌ 房间创建失败: {e}")
         return None
 
 def test_split_sync_interfaces():
@@ -86,13 +220,9 @@ def test_split_sync_interfaces():
     try:
         # 1. 获取房间基础信息
         print("1. 测试获取房间基础信息...")
-        response = requests.get(
-            f"{RUST_SERVER_URL}/management/sync/rooms",
-            headers=headers
-        )
-        
-        if response.status_code == 200:
-            rooms = response.json()
+        status, rooms = get_cached(rust, f"{RUST_SERVER_URL}/management/sync/rooms")
+
+        if status == 200:
             print(f"   ✅ 成功获取 {len(rooms)} 个房间的基础信息")
             
             if rooms:
@@ -102,48 +232,31 @@ def test_split_sync_interfaces():
                 print(f"      连接数: {rooms[0]['current_connections']}")
                 print(f"      管理员: {rooms[0]['admin_user_ids']}")
                 
-                # 2. 测试获取聊天记录（分页）
-                print("\n2. 测试获取聊天记录（分页）...")
-                response = requests.get(
-                    f"{RUST_SERVER_URL}/management/sync/chat-history/{room_id}",
-                    headers=headers,
-                    params={"page": 1, "limit": 10}
-                )
-                
-                if response.status_code == 200:
-                    chat_page = response.json()
-                    print(f"   ✅ 成功获取聊天记录")
-                    print(f"      房间ID: {chat_page['room_id']}")
-                    print(f"      记录数: {len(chat_page['records'])}")
-                    print(f"      分页信息: 第{chat_page['pagination']['current_page']}页，共{chat_page['pagination']['total_pages']}页")
-                    print(f"      总记录数: {chat_page['pagination']['total_records']}")
-                else:
-                    print(f"   ❌ 获取聊天记录失败: {response.status_code}")
-                
-                # 3. 测试获取会话历史（分页）
-                print("\n3. 测试获取会话历史（分页）...")
-                response = requests.get(
-                    f"{RUST_SERVER_URL}/management/sync/session-history/{room_id}",
-                    headers=headers,
-                    params={"page": 1, "limit": 10}
-                )
-                
-                if response.status_code == 200:
-                    session_page = response.json()
-                    print(f"   ✅ 成功获取会话历史")
-                    print(f"      房间ID: {session_page['room_id']}")
-                    print(f"      记录数: {len(session_page['records'])}")
-                    print(f"      分页信息: 第{session_page['pagination']['current_page']}页，共{session_page['pagination']['total_pages']}页")
-                    print(f"      总记录数: {session_page['pagination']['total_records']}")
-                else:
-                    print(f"   ❌ 获取会话历史失败: {response.status_code}")
+                # 2. 聊天记录只探测开头两页：融合成一次大limit请求
+                print("\n2. 测试获取聊天记录（前两页融合）...")
+                chat_page, chat_chunks = fetch_first_n_pages_fused(
+                    rust, f"{RUST_SERVER_URL}/management/sync/chat-history/{room_id}",
+                    pages=2, page_size=10)
+                print(f"   ✅ 成功获取聊天记录")
+                print(f"      房间ID: {chat_page['room_id']}")
+                print(f"      拉取记录数: {sum(len(c) for c in chat_chunks)}（前2页融合为1次请求）")
+                print(f"      总记录数: {chat_page['pagination']['total_records']}")
+
+                # 3. 会话历史全量拉取
+                print("\n3. 测试获取会话历史（并发分页）...")
+                session_page, session_records = fetch_all_pages(
+                    f"{RUST_SERVER_URL}/management/sync/session-history/{room_id}")
+                print(f"   ✅ 成功获取会话历史")
+                print(f"      房间ID: {session_page['room_id']}")
+                print(f"      拉取记录数: {len(session_records)}，共{session_page['pagination']['total_pages']}页")
+                print(f"      总记录数: {session_page['pagination']['total_records']}")
                 
                 return room_id
             else:
                 print("   ⚠️ 没有找到房间，跳过分页测试")
                 return None
         else:
-            print(f"   ❌ 获取房间基础信息失败: {response.status_code}")
+            print(f"   ❌ 获取房间基础信息失败: {status}")
             return None
             
     except Exception as e:
@@ -155,24 +268,29 @@ def test_legacy_sync_interface():
     print("\n=== 测试传统同步接口 ===")
     
     try:
-        response = requests.get(
-            f"{RUST_SERVER_URL}/management/sync",
-            headers=headers
-        )
-        
-        if response.status_code == 200:
-            sync_data = response.json()
-            print(f"✅ 成功获取传统同步数据")
-            print(f"   房间数量: {len(sync_data)}")
-            
-            for room in sync_data:
-                print(f"   📋 房间: {room['room_id']}")
-                print(f"      管理员: {room['admin_user_ids']}")
-                print(f"      聊天记录: {len(room['chat_history'])}条")
-                print(f"      会话记录: {len(room['session_history'])}条")
-                print()
-        else:
-            print(f"❌ 获取传统同步数据失败: {response.status_code}")
+        # 全量同步数据带完整聊天/会话历史，可能很大：流式逐条解析，
+        # 内存里只留当前一条而不是整包缓冲（此路径不走列表TTL缓存）
+        with rust.get(f"{RUST_SERVER_URL}/management/sync",
+                      stream=True, timeout=(2, 30)) as r:
+            if r.status_code != 200:
+                print(f"❌ 获取传统同步数据失败: {r.status_code}")
+                return
+            r.raw.decode_content = True
+
+            count = 0
+            buf = []
+            for room in ijson.items(r.raw, 'item'):
+                count += 1
+                buf.append(f"   📋 房间: {room['room_id']}")
+                buf.append(f"      管理员: {room['admin_user_ids']}")
+                buf.append(f"      聊天记录: {len(room['chat_history'])}条")
+                buf.append(f"      会话记录: {len(room['session_history'])}条")
+                buf.append("")
+
+        print(f"✅ 成功获取传统同步数据")
+        print(f"   房间数量: {count}")
+        if buf:
+            sys.stdout.write("\n".join(buf) + "\n")
             
     except Exception as e:
         print(f"❌ 测试传统接口失败: {e}")
@@ -182,10 +300,14 @@ def test_callback_server_stats():
     print("\n=== 测试回调服务器统计 ===")
     
     try:
-        # 获取房间列表
-        response = requests.get(f"{CALLBACK_SERVER_URL}/rooms")
-        if response.status_code == 200:
-            rooms = response.json()['rooms']
+        # 房间列表和统计信息互不依赖，并发拉取
+        (rooms_status, rooms_body), (stats_status, stats) = gather_requests([
+            (f"{CALLBACK_SERVER_URL}/rooms", None),
+            (f"{CALLBACK_SERVER_URL}/stats", None),
+        ])
+
+        if rooms_status == 200:
+            rooms = rooms_body['rooms']
             print(f"✅ 回调服务器房间列表: {len(rooms)}个房间")
             
             if rooms:
@@ -194,18 +316,14 @@ def test_callback_server_stats():
                 print(f"   最后同步: {rooms[0]['last_sync_formatted']}")
                 
                 # 获取房间详情
-                response = requests.get(f"{CALLBACK_SERVER_URL}/rooms/{room_id}")
-                if response.status_code == 200:
-                    details = response.json()
-                    print(f"   📊 房间详情:")
-                    print(f"      聊天记录数: {details['chat_count']}")
-                    print(f"      会话记录数: {details['session_count']}")
-                    print(f"      最近事件数: {len(details['recent_events'])}")
+                details = call(cb, "GET", f"{CALLBACK_SERVER_URL}/rooms/{room_id}").json()
+                print(f"   📊 房间详情:")
+                print(f"      聊天记录数: {details['chat_count']}")
+                print(f"      会话记录数: {details['session_count']}")
+                print(f"      最近事件数: {len(details['recent_events'])}")
         
-        # 获取统计信息
-        response = requests.get(f"{CALLBACK_SERVER_URL}/stats")
-        if response.status_code == 200:
-            stats = response.json()
+        # 统计信息
+        if stats_status == 200:
             print(f"\n📈 回调服务器统计:")
             print(f"   总房间数: {stats['total_rooms']}")
             print(f"   总聊天记录: {stats['total_chat_records']}")
@@ -221,25 +339,26 @@ def test_manual_sync_trigger():
     print("\n=== 测试手动触发同步 ===")
     
     try:
-        response = requests.post(
-            f"{RUST_SERVER_URL}/management/sync",
-            headers=headers
-        )
+        # 先记下基线，同步完成体现为today_syncs增长
+        baseline = -1
+        response = cb.get(f"{CALLBACK_SERVER_URL}/stats")
+        if response.status_code == 200:
+            baseline = response.json()['today_syncs']
+
+        call(rust, "POST", f"{RUST_SERVER_URL}/management/sync", expect=202)
+        print("✅ 手动同步已触发")
+        print("   📤 系统正在后台同步所有房间数据")
         
-        if response.status_code == 202:
-            print("✅ 手动同步已触发")
-            print("   📤 系统正在后台同步所有房间数据")
-            
-            # 等待一下让同步完成
-            time.sleep(3)
-            
-            # 检查回调服务器是否有新的同步记录
-            response = requests.get(f"{CALLBACK_SERVER_URL}/stats")
-            if response.status_code == 200:
-                stats = response.json()
-                print(f"   📊 当前统计: 今日同步 {stats['today_syncs']} 次")
+        # 轮询等同步落地，而不是固定sleep(3)
+        def _synced():
+            r = cb.get(f"{CALLBACK_SERVER_URL}/stats")
+            return r.status_code == 200 and r.json()['today_syncs'] > baseline
+
+        if wait_until(_synced, timeout=10.0):
+            stats = call(cb, "GET", f"{CALLBACK_SERVER_URL}/stats").json()
+            print(f"   📊 当前统计: 今日同步 {stats['today_syncs']} 次")
         else:
-            print(f"❌ 手动同步失败: {response.status_code}")
+            print("   ⚠️ 超时未观察到新的同步记录")
             
     except Exception as e:
         print(f"❌ 测试手动同步失败: {e}")
@@ -254,29 +373,26 @@ def test_close_room_with_events():
         print("❌ 无法创建房间进行关闭测试")
         return
     
-    # 等待一下
-    time.sleep(2)
+    # 轮询等创建同步在回调服务器落地
+    wait_until(lambda: cb.get(f"{CALLBACK_SERVER_URL}/rooms/{room_id}").status_code == 200,
+               timeout=10.0)
     
     try:
-        response = requests.delete(
-            f"{RUST_SERVER_URL}/management/rooms/{room_id}",
-            headers=headers
-        )
+        call(rust, "DELETE", f"{RUST_SERVER_URL}/management/rooms/{room_id}", expect=204)
+        print(f"✅ 房间关闭成功: {room_id}")
+        print("   📤 系统会自动触发房间关闭事件回调")
         
-        if response.status_code == 204:
-            print(f"✅ 房间关闭成功: {room_id}")
-            print("   📤 系统会自动触发房间关闭事件回调")
-            
-            # 等待一下让回调完成
-            time.sleep(3)
-            
-            # 检查回调服务器是否有房间关闭事件
-            response = requests.get(f"{CALLBACK_SERVER_URL}/rooms/{room_id}")
-            if response.status_code == 200:
-                details = response.json()
-                print(f"   📊 回调记录: {len(details['recent_events'])} 个事件")
+        # 轮询等room_closed事件回调落地
+        def _closed():
+            r = cb.get(f"{CALLBACK_SERVER_URL}/rooms/{room_id}")
+            return r.status_code == 200 and any(
+                e['event_type'] == 'room_closed' for e in r.json()['recent_events'])
+
+        if wait_until(_closed, timeout=10.0):
+            details = call(cb, "GET", f"{CALLBACK_SERVER_URL}/rooms/{room_id}").json()
+            print(f"   📊 回调记录: {len(details['recent_events'])} 个事件")
         else:
-            print(f"❌ 房间关闭失败: {response.status_code}")
+            print("   ⚠️ 超时未收到房间关闭事件")
             
     except Exception as e:
         print(f"❌ 测试关闭房间失败: {e}")
@@ -294,18 +410,19 @@ def main():
     # 2. 测试创建房间事件
     room_id = test_create_room_with_events()
     
-    # 3. 测试拆分后的同步接口
-    test_split_sync_interfaces()
-    
-    # 4. 测试传统同步接口
-    test_legacy_sync_interface()
+    # 3-5. 只读的几个阶段互不影响，并发跑，总耗时约等于最慢的一个
+    # （requests在socket等待时释放GIL，线程池足够）
+    independent = [
+        test_split_sync_interfaces,
+        test_legacy_sync_interface,
+        test_callback_server_stats,
+    ]
+    with ThreadPoolExecutor(max_workers=4) as ex:
+        list(ex.map(lambda f: f(), independent))
     
-    # 5. 测试手动触发同步
+    # 6. 手动同步会改动统计数据，放在并发阶段之后串行执行
     test_manual_sync_trigger()
     
-    # 6. 测试回调服务器统计
-    test_callback_server_stats()
-    
     # 7. 测试关闭房间事件
     test_close_room_with_events()
     
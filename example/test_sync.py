@@ -4,7 +4,13 @@
 演示如何使用Rust聊天服务器的同步功能
 """
 
+import sys
+
+import ijson
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import time
 import uuid
@@ -18,6 +24,42 @@ headers = {
     "X-Api-Key": API_KEY
 }
 
+# 瞬时故障（502/503/504）自动退避重试
+_retry = Retry(total=3, backoff_factor=0.1, status_forcelist=[502, 503, 504],
+               allowed_methods=frozenset(["GET", "POST", "DELETE"]))
+
+# 复用keep-alive连接，避免每个请求重建TCP连接
+session = requests.Session()
+session.headers.update(headers)
+session.mount("http://", HTTPAdapter(pool_connections=2, pool_maxsize=16, max_retries=_retry))
+
+def call(sess, method, url, *, expect=200, **kw):
+    """带默认超时和状态码校验的请求入口
+
+    连接2秒、读取10秒超时；状态码不等于expect时抛RuntimeError，
+    由调用方统一打印失败信息。
+    """
+    r = sess.request(method, url, timeout=(2, 10), **kw)
+    if r.status_code != expect:
+        raise RuntimeError(f"{method} {url} -> {r.status_code}: {r.text}")
+    return r
+
+
+def wait_until(pred, timeout=5.0, interval=0.1):
+    """轮询直到pred()为真或超时，代替凭感觉写死的sleep时长
+
+    pred抛异常视为尚未就绪。返回超时前是否满足条件。
+    """
+    t0 = time.monotonic()
+    while time.monotonic() - t0 < timeout:
+        try:
+            if pred():
+                return True
+        except Exception:
+            pass
+        time.sleep(interval)
+    return False
+
 def test_create_room_with_sync():
     """测试创建房间时的自动同步"""
     print("=== 测试创建房间时的自动同步 ===")
@@ -28,25 +70,16 @@ def test_create_room_with_sync():
     }
     
     try:
-        response = requests.post(
-            f"{SERVER_URL}/management/rooms",
-            headers=headers,
-            json=room_data
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            print(f"✅ 房间创建成功: {result['room_id']}")
-            print(f"   WebSocket URL: {result['websocket_url']}")
-            print("   📤 系统会自动触发数据同步")
-            return result['room_id']
-        else:
-            print(f"❌ 房间创建失败: {response.status_code}")
-            print(f"   错误信息: {response.text}")
-            return None
+        # orjson预序列化请求体，绕开json=内部的标准库dumps
+        result = call(session, "POST", f"{SERVER_URL}/management/rooms",
+                      data=orjson.dumps(room_data)).json()
+        print(f"✅ 房间创建成功: {result['room_id']}")
+        print(f"   WebSocket URL: {result['websocket_url']}")
+        print("   📤 系统会自动触发数据同步")
+        return result['room_id']
             
     except Exception as e:
-        print(f"❌ 请求失败: {e}")
+        print(f"❌ 房间创建失败: {e}")
         return None
 
 def test_manual_sync():
@@ -54,46 +87,41 @@ def test_manual_sync():
     print("\n=== 测试手动触发同步 ===")
     
     try:
-        response = requests.post(
-            f"{SERVER_URL}/management/sync",
-            headers=headers
-        )
-        
-        if response.status_code == 202:
-            print("✅ 手动同步已触发")
-            print("   📤 系统正在后台同步所有房间数据")
-        else:
-            print(f"❌ 手动同步失败: {response.status_code}")
-            print(f"   错误信息: {response.text}")
+        call(session, "POST", f"{SERVER_URL}/management/sync", expect=202)
+        print("✅ 手动同步已触发")
+        print("   📤 系统正在后台同步所有房间数据")
             
     except Exception as e:
-        print(f"❌ 请求失败: {e}")
+        print(f"❌ 手动同步失败: {e}")
 
 def test_get_sync_data():
     """测试获取同步数据"""
     print("\n=== 测试获取同步数据 ===")
     
     try:
-        response = requests.get(
-            f"{SERVER_URL}/management/sync",
-            headers=headers
-        )
-        
-        if response.status_code == 200:
-            sync_data = response.json()
-            print(f"✅ 成功获取同步数据")
-            print(f"   房间数量: {len(sync_data)}")
-            
-            for room in sync_data:
-                print(f"   📋 房间: {room['room_id']}")
-                print(f"      名称: {room['room_name']}")
-                print(f"      连接数: {room['current_connections']}")
-                print(f"      管理员: {room['admin_user_ids']}")
-                print(f"      封禁用户: {room['banned_user_ids']}")
-                print()
-        else:
-            print(f"❌ 获取同步数据失败: {response.status_code}")
-            print(f"   错误信息: {response.text}")
+        # 同步数据量大时不整包缓冲，流式逐条解析（不走列表TTL缓存）
+        with session.get(f"{SERVER_URL}/management/sync",
+                         stream=True, timeout=(2, 30)) as r:
+            if r.status_code != 200:
+                print(f"❌ 获取同步数据失败: {r.status_code}")
+                return
+            r.raw.decode_content = True
+
+            count = 0
+            buf = []
+            for room in ijson.items(r.raw, 'item'):
+                count += 1
+                buf.append(f"   📋 房间: {room['room_id']}")
+                buf.append(f"      名称: {room['room_name']}")
+                buf.append(f"      连接数: {room['current_connections']}")
+                buf.append(f"      管理员: {room['admin_user_ids']}")
+                buf.append(f"      封禁用户: {room['banned_user_ids']}")
+                buf.append("")
+
+        print(f"✅ 成功获取同步数据")
+        print(f"   房间数量: {count}")
+        if buf:
+            sys.stdout.write("\n".join(buf) + "\n")
             
     except Exception as e:
         print(f"❌ 请求失败: {e}")
@@ -103,27 +131,18 @@ def test_list_rooms():
     print("\n=== 测试获取房间列表 ===")
     
     try:
-        response = requests.get(
-            f"{SERVER_URL}/management/rooms",
-            headers=headers
-        )
-        
-        if response.status_code == 200:
-            rooms = response.json()
-            print(f"✅ 成功获取房间列表")
-            print(f"   房间数量: {len(rooms)}")
-            
-            for room in rooms:
-                print(f"   📋 房间: {room['room_id']}")
-                print(f"      名称: {room['room_name']}")
-                print(f"      连接数: {room['current_connections']}")
-                print()
-        else:
-            print(f"❌ 获取房间列表失败: {response.status_code}")
-            print(f"   错误信息: {response.text}")
-            
+        rooms = call(session, "GET", f"{SERVER_URL}/management/rooms").json()
+        print(f"✅ 成功获取房间列表")
+        print(f"   房间数量: {len(rooms)}")
+
+        for room in rooms:
+            print(f"   📋 房间: {room['room_id']}")
+            print(f"      名称: {room['room_name']}")
+            print(f"      连接数: {room['current_connections']}")
+            print()
+
     except Exception as e:
-        print(f"❌ 请求失败: {e}")
+        print(f"❌ 获取房间列表失败: {e}")
 
 def main():
     """主测试函数"""
@@ -132,7 +151,7 @@ def main():
     
     # 检查服务器是否运行
     try:
-        health_response = requests.get(f"{SERVER_URL}/management/health")
+        health_response = session.get(f"{SERVER_URL}/management/health")
         if health_response.status_code != 200:
             print("❌ 服务器未运行或无法访问")
             return
@@ -145,14 +164,18 @@ def main():
     room_id = test_create_room_with_sync()
     
     if room_id:
-        # 等待一下让同步完成
-        time.sleep(2)
+        # 轮询等新房间出现在列表里，替代固定sleep
+        wait_until(lambda: any(
+            r['room_id'] == room_id
+            for r in session.get(f"{SERVER_URL}/management/rooms").json()))
         
         # 测试手动同步
         test_manual_sync()
         
-        # 等待同步完成
-        time.sleep(2)
+        # 轮询等同步数据可拉取到新房间
+        wait_until(lambda: any(
+            r['room_id'] == room_id
+            for r in session.get(f"{SERVER_URL}/management/sync").json()))
         
         # 测试获取同步数据
         test_get_sync_data()
@@ -3,7 +3,15 @@
 测试拆分后的同步功能
 """
 
+import asyncio
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import time
 from datetime import datetime, timedelta
@@ -12,6 +20,106 @@ from datetime import datetime, timedelta
 BASE_URL = "http://localhost:3000"
 API_KEY = "test_key_123"
 
+headers = {
+    "Content-Type": "application/json",
+    "X-Api-Key": API_KEY
+}
+
+# 瞬时故障（502/503/504）自动退避重试
+_retry = Retry(total=3, backoff_factor=0.1, status_forcelist=[502, 503, 504],
+               allowed_methods=frozenset(["GET", "POST", "DELETE"]))
+
+# 复用keep-alive连接，默认头挂在会话上
+session = requests.Session()
+session.headers.update(headers)
+session.mount("http://", HTTPAdapter(pool_connections=2, pool_maxsize=16, max_retries=_retry))
+
+def call(sess, method, url, *, expect=200, **kw):
+    """带默认超时和状态码校验的请求入口
+
+    连接2秒、读取10秒超时；状态码不等于expect时抛RuntimeError，
+    由调用方统一打印失败信息。
+    """
+    r = sess.request(method, url, timeout=(2, 10), **kw)
+    if r.status_code != expect:
+        raise RuntimeError(f"{method} {url} -> {r.status_code}: {r.text}")
+    return r
+
+
+# 列表接口的进程内TTL缓存：多个测试函数反复拉同一份列表来发现room_id
+_listing_cache = {}
+
+def get_cached(sess, url, ttl=5):
+    """带TTL的列表GET：ttl秒内重复请求同一URL直接复用上次的响应
+
+    返回(status_code, json)，只有200的结果会进缓存。
+    """
+    now = time.monotonic()
+    hit = _listing_cache.get(url)
+    if hit and now - hit[0] < ttl:
+        return hit[1]
+    resp = sess.get(url)
+    result = (resp.status_code, orjson.loads(resp.content) if resp.status_code == 200 else None)
+    if resp.status_code == 200:
+        _listing_cache[url] = (now, result)
+    return result
+
+def fetch_all_pages(url, params=None, page_size=500, max_concurrency=8):
+    """把分页接口一次性拉完：首页探出总页数，剩余页并发抓取
+
+    逐页串行拉取的总耗时是页数×往返延迟，这里改成首页一趟之后
+    2..N页并发（信号量限流），整体耗时约等于最慢的一页。
+    返回(首页json, 各页records合并后的列表)。
+    """
+    base = dict(params or {})
+    base["limit"] = page_size
+
+    async def _fetch():
+        # HTTP/2下并发页请求在一条连接上多路复用，不支持时回退1.1
+        limits = httpx.Limits(max_keepalive_connections=max_concurrency,
+                              max_connections=max_concurrency)
+        timeout = httpx.Timeout(10.0, connect=2.0)
+        sem = asyncio.Semaphore(max_concurrency)
+        async with httpx.AsyncClient(http2=True, headers=headers,
+                                     limits=limits, timeout=timeout) as client:
+            async def _page(page):
+                async with sem:
+                    resp = await client.get(url, params={**base, "page": page})
+                    resp.raise_for_status()
+                    return orjson.loads(resp.content)
+            first = await _page(1)
+            total_pages = first['pagination']['total_pages']
+
+            # 哪页先回来就先消费哪页：拼接处理和还在途的请求重叠，
+            # 也不用等所有响应都攒齐才开始处理
+            async def _tagged(p):
+                return p, await _page(p)
+
+            chunks = {1: first['records']}
+            for fut in asyncio.as_completed([_tagged(p) for p in range(2, total_pages + 1)]):
+                p, body = await fut
+                chunks[p] = body['records']
+            records = []
+            for p in sorted(chunks):
+                records.extend(chunks[p])
+            return first, records
+    return asyncio.run(_fetch())
+
+def fetch_first_n_pages_fused(sess, url, pages=2, page_size=100, params=None):
+    """把前N页合并成一次大limit请求，再在本地切回每页大小的块
+
+    两次同模板的分页查询服务端要做两遍排序，合并成limit=N*page_size
+    的一趟既省一次往返也省一遍排序。适合只消费开头几页的探测场景。
+    返回(响应json, 按page_size切好的各页records列表)。
+    """
+    merged = dict(params or {})
+    merged.update({"page": 1, "limit": pages * page_size})
+    resp = call(sess, "GET", url, params=merged)
+    body = orjson.loads(resp.content)
+    records = body['records']
+    chunks = [records[i:i + page_size] for i in range(0, len(records), page_size)]
+    return body, chunks
+
 def test_room_creation():
     """测试房间创建"""
     print("=== 测试房间创建 ===")
@@ -22,41 +130,33 @@ def test_room_creation():
         "admin_user_ids": ["admin1", "admin2"]
     }
     
-    response = requests.post(
-        f"{BASE_URL}/management/rooms",
-        headers={
-            "Content-Type": "application/json",
-            "X-Api-Key": API_KEY
-        },
-        json=room_data
-    )
-    
-    if response.status_code == 200:
-        room = response.json()
-        print(f"✅ 房间创建成功: (ID: {room['room_id']})")
-        print(f"  - WebSocket URL: {room['websocket_url']}")
-        return room['room_id']
-    else:
-        print(f"❌ 房间创建失败: {response.status_code} - {response.text}")
+    # 用orjson预序列化请求体，比json=走的标准库dumps快不少
+    try:
+        room = call(session, "POST", f"{BASE_URL}/management/rooms",
+                    data=orjson.dumps(room_data)).json()
+    except Exception as e:
+        print(f"❌ 房间创建失败: {e}")
         return None
 
+    print(f"✅ 房间创建成功: (ID: {room['room_id']})")
+    print(f"  - WebSocket URL: {room['websocket_url']}")
+    return room['room_id']
+
 def test_rooms_sync():
     """测试房间基础信息同步"""
     print("\n=== 测试房间基础信息同步 ===")
     
-    response = requests.get(
-        f"{BASE_URL}/management/sync/rooms",
-        headers={"X-Api-Key": API_KEY}
-    )
-    
-    if response.status_code == 200:
-        rooms = response.json()
-        print(f"✅ 获取到 {len(rooms)} 个房间的基础信息")
-        for room in rooms:
-            print(f"  - {room['room_name']}: {room['current_connections']} 用户在线")
+    status, rooms = get_cached(session, f"{BASE_URL}/management/sync/rooms")
+
+    if status == 200:
+        # 房间多时逐行print每次都刷stdout，攒成一段一次写出
+        buf = [f"✅ 获取到 {len(rooms)} 个房间的基础信息"]
+        buf.extend(f"  - {room['room_name']}: {room['current_connections']} 用户在线"
+                   for room in rooms)
+        sys.stdout.write("\n".join(buf) + "\n")
         return True
     else:
-        print(f"❌ 获取房间信息失败: {response.status_code} - {response.text}")
+        print(f"❌ 获取房间信息失败: {status}")
         return False
 
 def test_chat_history_sync(room_id):
@@ -67,32 +167,24 @@ def test_chat_history_sync(room_id):
     end_time = int(time.time())
     start_time = end_time - 3600
     
-    params = {
-        "page": 1,
-        "limit": 100,
-        "from": start_time,
-        "to": end_time
-    }
-    
-    response = requests.get(
-        f"{BASE_URL}/management/sync/chat-history/{room_id}",
-        headers={"X-Api-Key": API_KEY},
-        params=params
-    )
-    
-    if response.status_code == 200:
-        data = response.json()
-        print(f"✅ 聊天记录同步成功")
-        print(f"  - 总记录数: {data['pagination']['total_records']}")
-        print(f"  - 当前页: {data['pagination']['current_page']}")
-        print(f"  - 每页大小: {data['pagination']['page_size']}")
-        print(f"  - 总页数: {data['pagination']['total_pages']}")
-        print(f"  - 实际返回: {len(data['records'])} 条记录")
-        return True
-    else:
-        print(f"❌ 聊天记录同步失败: {response.status_code} - {response.text}")
+    params = {"from": start_time, "to": end_time}
+
+    try:
+        data, chunks = fetch_first_n_pages_fused(
+            session, f"{BASE_URL}/management/sync/chat-history/{room_id}",
+            pages=2, page_size=100, params=params
+        )
+    except Exception as e:
+        print(f"❌ 聊天记录同步失败: {e}")
         return False
 
+    print(f"✅ 聊天记录同步成功")
+    print(f"  - 总记录数: {data['pagination']['total_records']}")
+    print(f"  - 每页大小: {data['pagination']['page_size']}")
+    print(f"  - 总页数: {data['pagination']['total_pages']}")
+    print(f"  - 实际返回: {sum(len(c) for c in chunks)} 条记录（前2页融合）")
+    return True
+
 def test_session_history_sync(room_id):
     """测试会话历史同步"""
     print(f"\n=== 测试会话历史同步 (房间: {room_id}) ===")
@@ -101,66 +193,51 @@ def test_session_history_sync(room_id):
     end_time = int(time.time())
     start_time = end_time - 86400
     
-    params = {
-        "page": 1,
-        "limit": 50,
-        "from": start_time,
-        "to": end_time
-    }
-    
-    response = requests.get(
-        f"{BASE_URL}/management/sync/session-history/{room_id}",
-        headers={"X-Api-Key": API_KEY},
-        params=params
-    )
-    
-    if response.status_code == 200:
-        data = response.json()
-        print(f"✅ 会话历史同步成功")
-        print(f"  - 总会话数: {data['pagination']['total_records']}")
-        print(f"  - 当前页: {data['pagination']['current_page']}")
-        print(f"  - 每页大小: {data['pagination']['page_size']}")
-        print(f"  - 总页数: {data['pagination']['total_pages']}")
-        print(f"  - 实际返回: {len(data['records'])} 个会话")
-        return True
-    else:
-        print(f"❌ 会话历史同步失败: {response.status_code} - {response.text}")
+    params = {"from": start_time, "to": end_time}
+
+    try:
+        data, records = fetch_all_pages(
+            f"{BASE_URL}/management/sync/session-history/{room_id}",
+            params=params
+        )
+    except Exception as e:
+        print(f"❌ 会话历史同步失败: {e}")
         return False
 
+    print(f"✅ 会话历史同步成功")
+    print(f"  - 总会话数: {data['pagination']['total_records']}")
+    print(f"  - 每页大小: {data['pagination']['page_size']}")
+    print(f"  - 总页数: {data['pagination']['total_pages']}")
+    print(f"  - 实际返回: {len(records)} 个会话")
+    return True
+
 def test_traditional_sync():
     """测试传统同步接口"""
     print("\n=== 测试传统同步接口 ===")
     
-    response = requests.get(
-        f"{BASE_URL}/management/sync",
-        headers={"X-Api-Key": API_KEY}
-    )
-    
-    if response.status_code == 200:
-        data = response.json()
+    status, data = get_cached(session, f"{BASE_URL}/management/sync")
+
+    if status == 200:
         print(f"✅ 传统同步接口成功")
         print(f"  - 房间数量: {len(data)}")
         return True
     else:
-        print(f"❌ 传统同步接口失败: {response.status_code} - {response.text}")
+        print(f"❌ 传统同步接口失败: {status}")
         return False
 
 def test_manual_sync():
     """测试手动触发同步"""
     print("\n=== 测试手动触发同步 ===")
     
-    response = requests.post(
-        f"{BASE_URL}/management/sync",
-        headers={"X-Api-Key": API_KEY}
-    )
-    
-    if response.status_code == 200:
-        print("✅ 手动同步触发成功")
-        return True
-    else:
-        print(f"❌ 手动同步触发失败: {response.status_code} - {response.text}")
+    try:
+        call(session, "POST", f"{BASE_URL}/management/sync", expect=202)
+    except Exception as e:
+        print(f"❌ 手动同步触发失败: {e}")
         return False
 
+    print("✅ 手动同步触发成功")
+    return True
+
 def main():
     """主测试函数"""
     print("🚀 开始测试拆分后的同步功能")
@@ -177,11 +254,17 @@ def main():
     # 等待一下让系统处理
     time.sleep(1)
     
-    # 测试各种同步接口
-    test_rooms_sync()
-    test_chat_history_sync(room_id)
-    test_session_history_sync(room_id)
-    test_traditional_sync()
+    # 只读的同步接口测试互不影响，并发跑完再做手动同步
+    independent = [
+        test_rooms_sync,
+        lambda: test_chat_history_sync(room_id),
+        lambda: test_session_history_sync(room_id),
+        test_traditional_sync,
+    ]
+    with ThreadPoolExecutor(max_workers=4) as ex:
+        list(ex.map(lambda f: f(), independent))
+
+    # 手动同步会触发后台写入，串行收尾
     test_manual_sync()
     
     print("\n" + "=" * 50)